@@ -0,0 +1,61 @@
+"""
+Helpers shared by the data scripts in this directory.
+
+Named common.py rather than http.py so it doesn't shadow the standard
+library's http package, which requests imports.
+"""
+
+import logging
+import sys
+from contextlib import contextmanager
+from logging.handlers import BufferingHandler
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = 'madeira-pass/1.0 (+https://github.com/sztanko/madeira-pass)'
+
+
+def build_session():
+    """Create an HTTP session with connection pooling and retries."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(total=3, backoff_factor=0.3)
+    )
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+# Shared session so repeated fetches reuse TCP/TLS connections
+SESSION = build_session()
+
+
+def configure_logging(logger, verbose):
+    """Send log output to stdout; the script's per-route lines only when verbose."""
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+
+@contextmanager
+def deferred_logging(logger):
+    """
+    Hold back a logger's records while the block runs, then emit them in order.
+
+    Used to keep output from a background thread from interleaving with
+    the main thread's console output.
+    """
+    buffer = BufferingHandler(capacity=sys.maxsize)
+    propagate = logger.propagate
+    logger.addHandler(buffer)
+    logger.propagate = False
+    try:
+        yield
+    finally:
+        logger.removeHandler(buffer)
+        logger.propagate = propagate
+        for record in buffer.buffer:
+            logger.handle(record)
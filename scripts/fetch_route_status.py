@@ -4,16 +4,22 @@ Fetch route status information from IFCN Madeira website.
 This script scrapes the official route status page and outputs JSON.
 """
 
-import json
+import argparse
+import logging
+import orjson
 import requests
 import urllib3
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from datetime import datetime
 from pathlib import Path
 
+from common import SESSION, configure_logging
+
 # Disable SSL warnings for the Madeira government website
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+logger = logging.getLogger(__name__)
+
 # URLs and paths
 STATUS_URL = 'https://ifcn.madeira.gov.pt/pt/atividades-de-natureza/percursos-pedestres-recomendados/percursos-pedestres-recomendados.html'
 OUTPUT_FILE = Path(__file__).parent.parent / 'public' / 'data' / 'route_status.json'
@@ -51,14 +57,14 @@ def fetch_route_status():
     print(f"Fetching route status from {STATUS_URL}...")
 
     try:
-        response = requests.get(STATUS_URL, verify=False, timeout=30)
+        response = SESSION.get(STATUS_URL, verify=False, timeout=30)
         response.raise_for_status()
     except requests.RequestException as e:
         print(f"Error fetching page: {e}")
         return None
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-    tables = soup.find_all('table')
+    tree = LexborHTMLParser(response.content)
+    tables = tree.css('table')
 
     if len(tables) < 2:
         print(f"Error: Expected at least 2 tables, found {len(tables)}")
@@ -71,14 +77,14 @@ def fetch_route_status():
     # Process first table (Madeira Island routes)
     print("\nProcessing Madeira Island routes (Table 1)...")
     madeira_table = tables[0]
-    rows = madeira_table.find_all('tr')[1:]  # Skip header row
+    rows = madeira_table.css('tr')[1:]  # Skip header row
 
     for row in rows:
-        cells = row.find_all(['td', 'th'])
+        cells = row.css('td, th')
         if len(cells) >= 6:
-            pr_num = cells[1].get_text(strip=True)
-            route_name = cells[2].get_text(strip=True)
-            status_text = cells[5].get_text(strip=True)
+            pr_num = cells[1].text(strip=True)
+            route_name = cells[2].text(strip=True)
+            status_text = cells[5].text(strip=True)
             status = normalize_status(status_text)
 
             if pr_num:
@@ -90,19 +96,19 @@ def fetch_route_status():
                     'status_text': status_text,
                     'island': 'Madeira'
                 }
-                print(f"  {route_id}: {status} - {route_name}")
+                logger.debug("  %s: %s - %s", route_id, status, route_name)
 
     # Process second table (Porto Santo routes)
     print("\nProcessing Porto Santo routes (Table 2)...")
     porto_santo_table = tables[1]
-    rows = porto_santo_table.find_all('tr')[1:]  # Skip header row
+    rows = porto_santo_table.css('tr')[1:]  # Skip header row
 
     for row in rows:
-        cells = row.find_all(['td', 'th'])
+        cells = row.css('td, th')
         if len(cells) >= 6:
-            pr_num = cells[1].get_text(strip=True)
-            route_name = cells[2].get_text(strip=True)
-            status_text = cells[5].get_text(strip=True)
+            pr_num = cells[1].text(strip=True)
+            route_name = cells[2].text(strip=True)
+            status_text = cells[5].text(strip=True)
             status = normalize_status(status_text)
 
             if pr_num:
@@ -114,7 +120,7 @@ def fetch_route_status():
                     'status_text': status_text,
                     'island': 'Porto Santo'
                 }
-                print(f"  {route_id}: {status} - {route_name}")
+                logger.debug("  %s: %s - %s", route_id, status, route_name)
 
     # Create output structure
     result = {
@@ -130,15 +136,26 @@ def save_route_status(data):
     """Save route status to JSON file."""
     OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    with open(OUTPUT_FILE, 'wb') as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
     print(f"\nRoute status saved to {OUTPUT_FILE}")
     print(f"Total routes: {len(data['routes'])}")
 
 
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Fetch route status from the IFCN Madeira website.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log every processed route')
+    return parser.parse_args()
+
+
 def main():
     """Main execution function."""
+    args = parse_args()
+    configure_logging(logger, args.verbose)
+
     data = fetch_route_status()
 
     if data is None:
@@ -3,24 +3,34 @@
 Process Madeira Pass routes data.
 
 This script:
-1. Reads all routes from data/routes.geojson
-2. Filters PR (Percurso Recomendado) routes
+1. Streams routes from data/routes.geojson
+2. Filters PR (Percurso Recomendado) routes while streaming
 3. Fetches the official list of routes requiring payment from Simplifica
 4. Marks routes as requiresPayment: true or false
 5. Merges route segments by reference and island
 6. Outputs to public/data/paid_routes.geojson
 """
 
-import json
+import argparse
+import logging
+import orjson
 import re
-import requests
+import ijson
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 import urllib3
 
+from common import SESSION, configure_logging, deferred_logging
+
 # Disable SSL warnings for the government website
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+logger = logging.getLogger(__name__)
+
 # File paths
 SCRIPT_DIR = Path(__file__).parent
 PROJECT_ROOT = SCRIPT_DIR.parent
@@ -30,6 +40,14 @@ OUTPUT_FILE = PROJECT_ROOT / "public" / "data" / "paid_routes.geojson"
 # Simplifica Payment Portal (lists ONLY routes requiring payment)
 SIMPLIFICA_URL = 'https://simplifica.madeira.gov.pt/services/78-82-259'
 
+# Geometry types that make up a hiking route
+_LINE_TYPES = frozenset({'LineString', 'MultiLineString'})
+
+# Route lines on the Simplifica page ("PR1 Vereda do Areeiro"), matched
+# over a whole page section at once; leading indentation is allowed and
+# the code must be followed by text on the same line
+_PR_CODE_RE = re.compile(r'^[^\S\n]*(PR\d+(?:\.\d+)?)[^\S\n]+\S', re.MULTILINE)
+
 
 def fetch_official_paid_routes():
     """
@@ -39,22 +57,23 @@ def fetch_official_paid_routes():
     Returns:
         Set of route IDs that require payment (e.g., {'PR1', 'PR2', 'PR1-PS'})
     """
-    print(f"\nFetching official paid routes from Simplifica payment portal...")
-    print(f"URL: {SIMPLIFICA_URL}")
+    logger.info("\nFetching official paid routes from Simplifica payment portal...")
+    logger.info("URL: %s", SIMPLIFICA_URL)
 
     try:
-        response = requests.get(SIMPLIFICA_URL, verify=False, timeout=30)
+        response = SESSION.get(SIMPLIFICA_URL, verify=False, timeout=30)
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
+        tree = LexborHTMLParser(response.content)
+        tree.strip_tags(['script', 'style'])
 
         # Get full text
-        text = soup.get_text()
+        text = tree.body.text()
 
         # Find the section with Madeira routes
         madeira_start = text.find('Ilha da Madeira')
 
         if madeira_start == -1:
-            print("⚠️  Warning: Could not find 'Ilha da Madeira' section")
+            logger.warning("⚠️  Warning: Could not find 'Ilha da Madeira' section")
             return None
 
         # Find where Porto Santo section starts (or end of relevant content)
@@ -66,65 +85,82 @@ def fetch_official_paid_routes():
         paid_route_ids = set()
 
         # Process Madeira routes (between madeira_start and porto_start)
-        print("  Processing Madeira Island routes...")
+        logger.info("  Processing Madeira Island routes...")
         if porto_start != -1:
             madeira_section = text[madeira_start:porto_start]
         else:
             madeira_section = text[madeira_start:madeira_start+5000]
 
-        # Extract route lines from Madeira section
-        lines = madeira_section.split('\n')
-        for line in lines:
-            line = line.strip()
-            # Look for lines starting with PR followed by number
-            if line.startswith('PR') and len(line) > 2:
-                # Extract just the PR code (e.g., "PR1" from "PR1 Vereda do Areeiro")
-                import re
-                match = re.match(r'^(PR\d+(?:\.\d+)?)\s+', line)
-                if match:
-                    route_id = match.group(1)
-                    paid_route_ids.add(route_id)
-                    print(f"    • {route_id}")
+        # Extract just the PR code of each route line
+        # (e.g., "PR1" from "PR1 Vereda do Areeiro")
+        for match in _PR_CODE_RE.finditer(madeira_section):
+            route_id = match.group(1)
+            paid_route_ids.add(route_id)
+            logger.debug("    • %s", route_id)
 
         # Process Porto Santo routes (after porto_start)
         if porto_start != -1:
-            print("  Processing Porto Santo routes...")
+            logger.info("  Processing Porto Santo routes...")
             porto_section = text[porto_start:porto_start+1000]
-            lines = porto_section.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line.startswith('PR') and len(line) > 2:
-                    import re
-                    match = re.match(r'^(PR\d+(?:\.\d+)?)\s+', line)
-                    if match:
-                        route_id = match.group(1) + '-PS'
-                        paid_route_ids.add(route_id)
-                        print(f"    • {route_id}")
-
-        print(f"\n✓ Found {len(paid_route_ids)} official paid routes on Simplifica")
+            for match in _PR_CODE_RE.finditer(porto_section):
+                route_id = match.group(1) + '-PS'
+                paid_route_ids.add(route_id)
+                logger.debug("    • %s", route_id)
+
+        logger.info("\n✓ Found %d official paid routes on Simplifica", len(paid_route_ids))
         return paid_route_ids
 
     except Exception as e:
-        print(f"⚠️  Error fetching paid routes: {e}")
-        print("⚠️  Falling back to marking all PR routes as paid")
-        import traceback
-        traceback.print_exc()
+        logger.warning("⚠️  Error fetching paid routes: %s", e)
+        logger.warning("⚠️  Falling back to marking all PR routes as paid", exc_info=True)
         return None
 
 
-def load_all_routes():
-    """Load all routes from the source GeoJSON file."""
+def iter_pr_features(f):
+    """
+    Stream PR (Percurso Recomendado) route features from a GeoJSON file.
+
+    Features are decoded one at a time, so routes that are not PR lines
+    are discarded without ever holding the whole collection in memory.
+
+    Args:
+        f: Source GeoJSON file opened in binary mode
+
+    Yields:
+        Features with a LineString/MultiLineString geometry and a PR ref
+    """
+    # ijson picks the fastest available backend (yajl2_c when installed)
+    for feature in ijson.items(f, 'features.item', use_float=True):
+        try:
+            geometry = feature['geometry']
+            properties = feature['properties']
+        except KeyError:
+            continue
+
+        # Only consider LineString and MultiLineString geometries
+        if geometry.get('type', '') not in _LINE_TYPES:
+            continue
+
+        # Check if it's a PR route (normalized ref starts with "PR");
+        # normalize_ref upper-cases and is cached for the grouping pass
+        if normalize_ref(properties.get('ref', '')).startswith('PR'):
+            yield feature
+
+
+def load_pr_route_segments():
+    """Load PR route segments from the source GeoJSON file, grouped by ref and island."""
     try:
-        with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(INPUT_FILE, 'rb') as f:
+            return group_route_segments(iter_pr_features(f))
     except FileNotFoundError:
         print(f"Error: {INPUT_FILE} not found")
         return None
-    except json.JSONDecodeError as e:
+    except ijson.JSONError as e:
         print(f"Error parsing GeoJSON: {e}")
         return None
 
 
+@lru_cache(maxsize=4096)
 def normalize_ref(ref_string):
     """
     Normalize a PR reference code for matching.
@@ -138,12 +174,11 @@ def normalize_ref(ref_string):
         return ""
 
     # Extract PR code (everything before | if present)
-    ref_string = ref_string.split('|')[0].strip()
+    ref_string = ref_string.split('|', 1)[0].strip().upper()
 
-    # Remove spaces between PR and number
-    ref_string = re.sub(r'PR\s+', 'PR', ref_string, flags=re.IGNORECASE)
-
-    return ref_string.upper()
+    # Remove whitespace after every PR prefix (e.g. "PR 21 <-> PR 22")
+    parts = ref_string.split('PR')
+    return 'PR'.join([parts[0]] + [part.lstrip() for part in parts[1:]])
 
 
 def get_island_from_coordinates(geometry):
@@ -156,79 +191,105 @@ def get_island_from_coordinates(geometry):
     Returns:
         'Porto Santo' or 'Madeira'
     """
-    # Extract first coordinate to determine location
-    coords = geometry.get('coordinates', [])
+    # Only the longitude of the first point is needed. A LineString starts
+    # with a point ([lon, lat]), a MultiLineString with a line of points.
+    coords = geometry['coordinates']
+    if not coords or not coords[0]:
+        return 'Madeira'
 
-    if geometry['type'] == 'LineString':
-        lon = coords[0][0] if coords else -17.0
-    elif geometry['type'] == 'MultiLineString':
-        lon = coords[0][0][0] if coords and coords[0] else -17.0
-    else:
-        lon = -17.0
+    first = coords[0]
+    lon = first[0] if isinstance(first[0], (int, float)) else first[0][0]
 
     # Porto Santo is at longitude ~-16.3, Madeira main island is at ~-17.0
     # Use -16.5 as the dividing line
     return 'Porto Santo' if lon > -16.5 else 'Madeira'
 
 
-def merge_route_segments(features, paid_route_ids=None):
+def segment_lines(geometry):
     """
-    Merge route segments with the same reference into single features.
-    Separates routes by island (Madeira vs Porto Santo).
+    Return the lines of a LineString or MultiLineString geometry.
 
     Args:
-        features: List of route features
-        paid_route_ids: Set of route IDs that require payment (or None to mark all as paid)
+        geometry: GeoJSON geometry
 
     Returns:
-        List of merged features with combined geometries
+        List of coordinate lists, one per line
+    """
+    if geometry['type'] == 'LineString':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+def group_route_segments(features):
     """
-    # Group features by normalized ref AND island
-    routes_by_ref_and_island = {}
+    Group route segments by normalized reference and island in a single pass.
+
+    Args:
+        features: Iterable of route features (may be a stream)
+
+    Returns:
+        Dict mapping (ref, island) tuples to lists of (properties, lines)
+        segment tuples, where lines is the segment's list of coordinate lists
+    """
+    routes_by_ref_and_island = defaultdict(list)
 
     for feature in features:
-        ref = feature['properties'].get('ref', '')
-        normalized_ref = normalize_ref(ref)
-        island = get_island_from_coordinates(feature['geometry'])
+        properties = feature['properties']
+        geometry = feature['geometry']
+        normalized_ref = normalize_ref(properties.get('ref', ''))
+        island = get_island_from_coordinates(geometry)
 
-        # Create a key that includes both ref and island
-        key = f"{normalized_ref}|{island}"
+        routes_by_ref_and_island[(normalized_ref, island)].append(
+            (properties, segment_lines(geometry))
+        )
 
-        if key not in routes_by_ref_and_island:
-            routes_by_ref_and_island[key] = []
-        routes_by_ref_and_island[key].append(feature)
+    return routes_by_ref_and_island
 
-    merged_features = []
 
-    for key, segments in routes_by_ref_and_island.items():
-        ref, island = key.split('|')
+def merge_route_segments(routes_by_ref_and_island, paid_route_ids=None):
+    """
+    Merge route segments with the same reference into single features.
+    Separates routes by island (Madeira vs Porto Santo).
+
+    Args:
+        routes_by_ref_and_island: Grouped route segments (see group_route_segments)
+        paid_route_ids: Set of route IDs that require payment (or None to mark all as paid)
+
+    Returns:
+        List of merged features with combined geometries
+    """
+    merged_features = []
+    verbose = logger.isEnabledFor(logging.DEBUG)
 
-        # Find the segment with the most complete properties (has name)
-        best_properties = None
-        for segment in segments:
-            props = segment['properties']
-            if props.get('name') and props.get('name') != 'N/A':
-                best_properties = props
-                break
+    for (ref, island), segments in routes_by_ref_and_island.items():
 
-        # Fallback to first segment if none have names
-        if best_properties is None:
-            best_properties = segments[0]['properties']
+        # Use the first segment that has a name, falling back to the first segment
+        best_properties = next(
+            (props for props, _ in segments
+             if props.get('name') not in (None, '', 'N/A')),
+            segments[0][0]
+        )
 
-        # Collect all line geometries
+        # Collect all line geometries, dropping empty lines and lines repeated
+        # by overlapping segments (same length and endpoints)
         all_coordinates = []
-        for segment in segments:
-            geom = segment['geometry']
-            if geom['type'] == 'LineString':
-                all_coordinates.append(geom['coordinates'])
-            elif geom['type'] == 'MultiLineString':
-                all_coordinates.extend(geom['coordinates'])
-
-        # Create merged feature
-        merged_geometry = {
-            'type': 'MultiLineString' if len(all_coordinates) > 1 else 'LineString',
-            'coordinates': all_coordinates if len(all_coordinates) > 1 else all_coordinates[0]
-        }
+        seen_lines = set()
+        for line in chain.from_iterable(lines for _, lines in segments):
+            if not line:
+                continue
+            line_key = (len(line), tuple(line[0]), tuple(line[-1]))
+            if line_key in seen_lines:
+                continue
+            seen_lines.add(line_key)
+            all_coordinates.append(line)
+
+        if not all_coordinates:
+            logger.warning("  ⚠️  Skipping %s (%s): no line geometry", ref, island)
+            continue
+
+        # Create merged feature; always a MultiLineString so consumers
+        # only deal with one geometry type
+        merged_geometry = {'type': 'MultiLineString', 'coordinates': all_coordinates}
 
         # Create unique ID with island suffix for Porto Santo
         route_id = f"{ref}-PS" if island == 'Porto Santo' else ref
@@ -245,64 +306,45 @@ def merge_route_segments(features, paid_route_ids=None):
         else:
             requires_payment = route_id in paid_route_ids
 
-        payment_status = "💰 PAID" if requires_payment else "🆓 FREE"
+        properties = best_properties.copy()
+        properties['id'] = route_id
+        properties['name'] = route_name
+        properties['island'] = island
+        properties['requiresPayment'] = requires_payment
 
         merged_feature = {
             'type': 'Feature',
-            'properties': {
-                **best_properties,
-                'id': route_id,
-                'name': route_name,
-                'island': island,
-                'requiresPayment': requires_payment
-            },
+            'properties': properties,
             'geometry': merged_geometry
         }
 
         merged_features.append(merged_feature)
-        print(f"  ✓ Merged {len(segments)} segment(s) for {route_id} ({island}) [{payment_status}]: {route_name}")
+        if verbose:
+            payment_status = "💰 PAID" if requires_payment else "🆓 FREE"
+            logger.debug("  ✓ Merged %d segment(s) for %s (%s) [%s]: %s",
+                         len(segments), route_id, island, payment_status, route_name)
 
     return merged_features
 
 
-def process_pr_routes(all_routes, paid_route_ids=None):
+def process_pr_routes(routes_by_ref_and_island, paid_route_ids=None):
     """
     Process all PR (Percurso Recomendado) routes and mark them as paid or free.
 
     Args:
-        all_routes: GeoJSON FeatureCollection with all routes
+        routes_by_ref_and_island: Grouped PR route segments (see group_route_segments)
         paid_route_ids: Set of route IDs that require payment (or None to mark all as paid)
 
     Returns:
         GeoJSON FeatureCollection with all PR routes (paid and free)
     """
-    print("\nFiltering PR routes...")
-
-    pr_features = []
-    pr_refs = set()
-
-    # Filter routes from GeoJSON
-    for feature in all_routes.get('features', []):
-        properties = feature.get('properties', {})
-        geometry_type = feature.get('geometry', {}).get('type', '')
-
-        # Only consider LineString and MultiLineString geometries
-        if geometry_type not in ['LineString', 'MultiLineString']:
-            continue
+    segment_count = sum(len(segments) for segments in routes_by_ref_and_island.values())
+    pr_refs = {ref for ref, _ in routes_by_ref_and_island}
 
-        # Get the ref field
-        ref = properties.get('ref', '')
-
-        # Check if it's a PR route (starts with "PR")
-        if ref and ref.upper().startswith('PR'):
-            normalized_ref = normalize_ref(ref)
-            pr_features.append(feature)
-            pr_refs.add(normalized_ref)
-
-    print(f"Found {len(pr_features)} PR route segments ({len(pr_refs)} unique refs)")
+    print(f"Found {segment_count} PR route segments ({len(pr_refs)} unique refs)")
 
     print(f"\nMerging route segments...")
-    merged_features = merge_route_segments(pr_features, paid_route_ids)
+    merged_features = merge_route_segments(routes_by_ref_and_island, paid_route_ids)
 
     # Count paid vs free routes
     paid_count = sum(1 for f in merged_features if f['properties']['requiresPayment'])
@@ -319,34 +361,77 @@ def process_pr_routes(all_routes, paid_route_ids=None):
     }
 
 
+def iter_feature_collection_json(features):
+    """
+    Encode a FeatureCollection as compact JSON, one feature at a time.
+
+    Only one encoded feature is held in memory instead of the whole document.
+
+    Args:
+        features: List of GeoJSON features
+
+    Yields:
+        Chunks of UTF-8 encoded JSON
+    """
+    yield b'{"type":"FeatureCollection","features":['
+    for i, feature in enumerate(features):
+        if i:
+            yield b','
+        yield orjson.dumps(feature)
+    yield b']}'
+
+
 def save_paid_routes(paid_routes):
     """Save filtered routes to output file."""
     OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(paid_routes, f, indent=2, ensure_ascii=False)
+    # Compact JSON: the web app downloads and parses this file at runtime
+    with open(OUTPUT_FILE, 'wb') as f:
+        for chunk in iter_feature_collection_json(paid_routes['features']):
+            f.write(chunk)
 
     print(f"Processed {len(paid_routes['features'])} paid routes")
     print(f"Output saved to {OUTPUT_FILE}")
 
 
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Process Madeira Pass routes data.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log every processed route')
+    return parser.parse_args()
+
+
 def main():
     """Main processing function."""
+    args = parse_args()
+    configure_logging(logger, args.verbose)
+
     print("=" * 70)
     print("MADEIRA PASS ROUTES PROCESSOR")
     print("=" * 70)
 
-    # Fetch official list of paid routes
-    paid_route_ids = fetch_official_paid_routes()
+    # Check up front so a missing input doesn't wait on the whole fetch
+    if not INPUT_FILE.exists():
+        print(f"Error: {INPUT_FILE} not found")
+        return
+
+    # Fetch official list of paid routes in the background while the
+    # source GeoJSON is read and parsed; the fetch's log output is held
+    # back until it finishes so it doesn't interleave with the loading
+    with deferred_logging(logger), ThreadPoolExecutor(max_workers=1) as executor:
+        paid_routes_future = executor.submit(fetch_official_paid_routes)
+
+        print(f"\nLoading PR routes from {INPUT_FILE}...")
+        routes_by_ref_and_island = load_pr_route_segments()
 
-    print(f"\nLoading all routes from {INPUT_FILE}...")
-    all_routes = load_all_routes()
+        paid_route_ids = paid_routes_future.result()
 
-    if all_routes is None:
+    if routes_by_ref_and_island is None:
         return
 
     print("\nProcessing PR routes (marking paid vs free)...")
-    processed_routes = process_pr_routes(all_routes, paid_route_ids)
+    processed_routes = process_pr_routes(routes_by_ref_and_island, paid_route_ids)
 
     print("\nSaving processed routes...")
     save_paid_routes(processed_routes)